@@ -1,12 +1,16 @@
-from flask import Flask, request, render_template, jsonify, session
+from flask import Flask, Response, request, render_template, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
-from smart_ai import SmartAIPortfolio
+from smart_ai import get_portfolio
 from database import PortfolioDatabase
 import os
 import re
+import json
 import secrets
+import threading
+import redis
+import orjson
 from dotenv import load_dotenv
-from collections import deque
+from collections import deque, OrderedDict
 from datetime import datetime
 
 # Load environment variables
@@ -19,6 +23,12 @@ app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 # SQLAlchemy Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_pre_ping': True,
+    'pool_recycle': 300
+}
 
 # Initialize Database
 try:
@@ -29,13 +39,73 @@ except Exception as e:
     db = None
 
 # Initialize Smart AI Portfolio System
-ai_system = SmartAIPortfolio()
+ai_system = get_portfolio()
 
-# Session context - store last 5 messages (100/5 = 20% per message)
-chat_context = deque(maxlen=5)
+# Session context - store last 5 messages per session (100/5 = 20% per message)
+CHAT_CONTEXT_SIZE = 5
+CHAT_CONTEXT_TTL = 3600  # seconds
+MAX_LOCAL_CONTEXTS = 1000
+
+# Use Redis when configured so context is shared across workers
+REDIS_URL = os.environ.get('REDIS_URL')
+REDIS_TIMEOUT = 1  # seconds, so an outage falls back quickly instead of stalling /chat
+redis_client = (
+    redis.Redis.from_url(REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT)
+    if REDIS_URL else None
+)
+
+# In-process fallback, evicting least recently used sessions
+local_contexts = OrderedDict()
+local_contexts_lock = threading.Lock()
+
+def get_chat_context(session_id):
+    """Get recent chat messages for a session."""
+    if redis_client:
+        key = f"chat_context:{session_id}"
+        try:
+            return [json.loads(m) for m in redis_client.lrange(key, 0, -1)]
+        except redis.RedisError as e:
+            print(f"⚠️ Redis unavailable, using local chat context: {e}")
+    
+    with local_contexts_lock:
+        context = local_contexts.get(session_id)
+        if context is None:
+            return []
+        local_contexts.move_to_end(session_id)
+        # Snapshot under the lock, another request may append concurrently
+        return tuple(context)
+
+def append_chat_context(session_id, *messages):
+    """Append messages to a session's chat context, keeping the last few."""
+    if redis_client:
+        key = f"chat_context:{session_id}"
+        pipe = redis_client.pipeline()
+        pipe.rpush(key, *[json.dumps(m) for m in messages])
+        pipe.ltrim(key, -CHAT_CONTEXT_SIZE, -1)
+        pipe.expire(key, CHAT_CONTEXT_TTL)
+        try:
+            pipe.execute()
+            return
+        except redis.RedisError as e:
+            print(f"⚠️ Redis unavailable, storing chat context locally: {e}")
+    
+    with local_contexts_lock:
+        context = local_contexts.get(session_id)
+        if context is None:
+            context = local_contexts[session_id] = deque(maxlen=CHAT_CONTEXT_SIZE)
+        local_contexts.move_to_end(session_id)
+        context.extend(messages)
+        while len(local_contexts) > MAX_LOCAL_CONTEXTS:
+            local_contexts.popitem(last=False)
+
+PREPROCESS_RE = re.compile(r'\b(she|her|sarmitha)\b', re.IGNORECASE)
 
 def preprocess(text):
-    return re.sub(r'\b(she|her|sarmitha)\b', 'you', text, flags=re.IGNORECASE)
+    return PREPROCESS_RE.sub('you', text)
+
+def json_response(payload, status=200):
+    """Serialize payload with orjson into a JSON response."""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
 
 def get_session_id():
     """Get or create session ID."""
@@ -78,12 +148,12 @@ def chat():
     session_id = get_session_id()
     user_raw = request.json.get("message", "").strip()
     if not user_raw:
-        return jsonify({"response": "❗ Please enter a valid message."})
+        return json_response({"response": "❗ Please enter a valid message."})
 
     # Process with Smart AI System (pass current context)
     response, context_coverage = ai_system.process_query(
         user_raw, 
-        list(chat_context)  # Pass all current context
+        get_chat_context(session_id)  # Pass all current context
     )
     
     # Store Q&A in database
@@ -99,10 +169,13 @@ def chat():
             print(f"⚠️ Failed to store Q&A log: {e}")
     
     # Add both user message and AI response to context
-    chat_context.append({"role": "user", "content": user_raw})
-    chat_context.append({"role": "assistant", "content": response})
+    append_chat_context(
+        session_id,
+        {"role": "user", "content": user_raw},
+        {"role": "assistant", "content": response}
+    )
     
-    return jsonify({
+    return json_response({
         "response": response,
         "context_coverage": context_coverage
     })
@@ -125,13 +198,10 @@ def get_admin_data():
         return jsonify({"error": "Database not available"}), 500
     
     try:
-        # Clean up expired sessions
-        db.cleanup_expired_sessions()
-        
         analytics = db.get_analytics()
         qa_logs = db.get_qa_logs(limit=50)
         
-        return jsonify({
+        return json_response({
             "visitor_count": analytics["unique_visitors"],
             "total_qa": analytics["total_qa"],
             "total_likes": analytics["total_likes"],
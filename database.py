@@ -1,23 +1,117 @@
 import hashlib
+import hmac
+import ssl
 import secrets
 import os
+import atexit
+import functools
+import queue
+import threading
+import time
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 import json
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from sqlalchemy import insert, text
+from sqlalchemy.schema import CreateIndex
 
 # Initialize SQLAlchemy
 db = SQLAlchemy()
 
+# Visitor write-back buffer settings
+VISITOR_QUEUE_MAXSIZE = 10000
+VISITOR_BATCH_SIZE = 500
+VISITOR_FLUSH_INTERVAL = 1.0  # seconds
+
+# Retention limits, applied by the background maintenance thread
+VISITOR_RETENTION_DAYS = 30
+QA_LOG_RETENTION_ROWS = 10000
+PRUNE_INTERVAL = 24 * 60 * 60  # seconds
+
+# Time-to-live for cached counters
+STATS_CACHE_TTL = 30  # seconds
+
+# scrypt parameters for admin password hashes
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Admin password hashes keyed by username, re-read from the database after the TTL
+# so a rotated password stops working in every worker. Missing users are cached too.
+ADMIN_HASH_CACHE_TTL = 60  # seconds
+ADMIN_HASH_CACHE_MAX = 128
+_admin_hash_cache = {}
+_admin_hash_lock = threading.Lock()
+
+def hash_password(password: str) -> str:
+    """Hash password with a random salt using scrypt."""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    """scrypt hash of a random password, checked when the username does not exist."""
+    return hash_password(secrets.token_urlsafe(16))
+
+def _is_legacy_hash(stored_hash: str) -> bool:
+    """Check whether stored hash is an unsalted SHA-256 digest."""
+    return not stored_hash.startswith("scrypt$")
+
+def check_password(password: str, stored_hash: str) -> bool:
+    """Verify password against stored hash in constant time."""
+    if _is_legacy_hash(stored_hash):
+        # Pay for one scrypt anyway so a legacy admin row can't be told apart from unknown users
+        check_password(password, _dummy_hash())
+        computed = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(computed, stored_hash)
+    
+    try:
+        _, n, r, p, salt, expected = stored_hash.split("$")
+        computed = hashlib.scrypt(
+            password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p)
+        )
+    except ValueError:
+        return False
+    return hmac.compare_digest(computed.hex(), expected)
+
+# Prebuilt SQL statements
+SQL_PRUNE_VISITORS = text("DELETE FROM visitors WHERE visit_time < :cutoff")
+SQL_PRUNE_QA_LOGS = text(
+    "DELETE FROM qa_logs WHERE id NOT IN "
+    "(SELECT id FROM qa_logs ORDER BY timestamp DESC LIMIT :keep)"
+)
+SQL_INSERT_QA_LOG = text(
+    "INSERT INTO qa_logs (question, answer, session_id, context_coverage, timestamp) "
+    "VALUES (:q, :a, :sid, :cov, :ts)"
+)
+SQL_TOGGLE_LIKE = text(
+    "INSERT INTO likes (session_id, liked, timestamp) VALUES (:sid, :liked, :ts) "
+    "ON CONFLICT (session_id) DO UPDATE SET liked = NOT likes.liked "
+    "RETURNING liked"
+)
+SQL_COUNT_LIKES = text("SELECT count(*) FROM likes WHERE liked = :liked")
+SQL_ANALYTICS = text(
+    "SELECT "
+    "(SELECT count(*) FROM visitors) AS total_visitors, "
+    "(SELECT count(DISTINCT session_id) FROM visitors WHERE session_id IS NOT NULL) AS unique_visitors, "
+    "(SELECT count(*) FROM qa_logs) AS total_qa, "
+    "(SELECT count(*) FROM likes WHERE liked = :liked) AS total_likes, "
+    "(SELECT count(*) FROM visitors WHERE visit_time > :since) AS visitors_24h"
+)
+SQL_ADMIN_SESSION_EXISTS = text(
+    "SELECT EXISTS (SELECT 1 FROM admin_sessions "
+    "WHERE session_token = :token AND expires_at > :now)"
+)
+
 # SQLAlchemy Models
 class Visitor(db.Model):
     __tablename__ = 'visitors'
     id = db.Column(db.Integer, primary_key=True)
     ip_address = db.Column(db.String(45), nullable=False)
     user_agent = db.Column(db.Text)
-    session_id = db.Column(db.String(255))
-    visit_time = db.Column(db.DateTime, default=datetime.utcnow)
+    session_id = db.Column(db.String(255), index=True)
+    visit_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 class QALog(db.Model):
     __tablename__ = 'qa_logs'
@@ -26,13 +120,13 @@ class QALog(db.Model):
     answer = db.Column(db.Text, nullable=False)
     session_id = db.Column(db.String(255))
     context_coverage = db.Column(db.Float)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 class Like(db.Model):
     __tablename__ = 'likes'
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(255), unique=True, nullable=False)
-    liked = db.Column(db.Boolean, default=False)
+    liked = db.Column(db.Boolean, default=False, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
 class AdminCredential(db.Model):
@@ -47,7 +141,7 @@ class AdminSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), nullable=False)
     session_token = db.Column(db.String(255), unique=True, nullable=False)
-    expires_at = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
 
 class PortfolioDatabase:
     def __init__(self, app=None):
@@ -58,6 +152,25 @@ class PortfolioDatabase:
             # For backward compatibility
             self.app = None
         self.init_database()
+        
+        # Visitor rows are buffered and written in batches off the request path
+        self._visitor_queue = queue.Queue(maxsize=VISITOR_QUEUE_MAXSIZE)
+        self._flush_lock = threading.Lock()
+        if self.app:
+            self._visitor_thread = threading.Thread(
+                target=self._visitor_writer, name="visitor-writer", daemon=True
+            )
+            self._visitor_thread.start()
+            atexit.register(self.flush_visitors)
+            
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, name="db-maintenance", daemon=True
+            )
+            self._maintenance_thread.start()
+        
+        # Short-lived cache for count queries
+        self._stats_cache = {}
+        self._stats_lock = threading.Lock()
     
     
     def init_database(self):
@@ -65,13 +178,36 @@ class PortfolioDatabase:
         if not self.app:
             return  # Skip if not initialized with app
         
+        self._log_hash_backend()
+        _dummy_hash()  # Precompute so the first unknown-username login isn't slower
+        
         with self.app.app_context():
             # Create all tables
             db.create_all()
             
+            # create_all skips existing tables, so add any missing indexes
+            self._ensure_indexes()
+            
             # Initialize admin credentials if not exists
             self._init_admin_credentials()
     
+    def _log_hash_backend(self):
+        """Log which OpenSSL build backs hashlib for password hashing."""
+        print(f"🔐 hashlib using {ssl.OPENSSL_VERSION}")
+        if not hasattr(hashlib, "scrypt"):
+            print("⚠️ hashlib.scrypt unavailable, admin login requires Python built against OpenSSL 1.1+")
+    
+    def _ensure_indexes(self):
+        """Create model indexes that are missing on existing tables."""
+        # Every worker runs this at startup, so another one may create the same index concurrently
+        for model in (Visitor, QALog, Like, AdminSession):
+            for index in model.__table__.indexes:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(CreateIndex(index, if_not_exists=True))
+                except Exception as e:
+                    print(f"⚠️ Skipped creating index {index.name}: {e}")
+    
     def _init_admin_credentials(self):
         """Initialize admin credentials."""
         with self.app.app_context():
@@ -82,7 +218,7 @@ class PortfolioDatabase:
                 username = os.getenv('ADMIN_USERNAME')
                 password = os.getenv('ADMIN_PASSWORD')
     
-                password_hash = hashlib.sha256(password.encode()).hexdigest()
+                password_hash = hash_password(password)
                 
                 admin_cred = AdminCredential(
                     username=username,
@@ -91,145 +227,231 @@ class PortfolioDatabase:
                 )
                 db.session.add(admin_cred)
                 db.session.commit()
+            elif _is_legacy_hash(existing_admin.password_hash):
+                # Upgrade a legacy SHA-256 hash now instead of waiting for the next login
+                password = os.getenv('ADMIN_PASSWORD')
+                if password and hmac.compare_digest(
+                    hashlib.sha256(password.encode()).hexdigest(), existing_admin.password_hash
+                ):
+                    existing_admin.password_hash = hash_password(password)
+                    db.session.commit()
+    
+    def _cached(self, key: str, loader):
+        """Return cached value for key, reloading it once the TTL expires."""
+        now = time.monotonic()
+        with self._stats_lock:
+            entry = self._stats_cache.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        value = loader()
+        with self._stats_lock:
+            self._stats_cache[key] = (now + STATS_CACHE_TTL, value)
+        return value
+    
+    def _invalidate(self, key: str):
+        """Drop cached value for key."""
+        with self._stats_lock:
+            self._stats_cache.pop(key, None)
     
     def add_visitor(self, ip_address: str, user_agent: str, session_id: str):
-        """Add visitor to database."""
+        """Queue visitor for the next batched insert."""
+        try:
+            self._visitor_queue.put_nowait({
+                "ip_address": ip_address,
+                "user_agent": user_agent,
+                "session_id": session_id,
+                "visit_time": datetime.utcnow()
+            })
+        except queue.Full:
+            print("⚠️ Visitor queue full, dropping visit")
+    
+    def _visitor_writer(self):
+        """Background loop that flushes queued visitors in batches."""
+        while True:
+            time.sleep(VISITOR_FLUSH_INTERVAL)
+            try:
+                self.flush_visitors()
+            except Exception as e:
+                print(f"⚠️ Failed to flush visitors: {e}")
+    
+    def flush_visitors(self):
+        """Write queued visitors to the database, one multi-row INSERT per batch."""
+        with self._flush_lock:
+            while True:
+                rows = []
+                while len(rows) < VISITOR_BATCH_SIZE:
+                    try:
+                        rows.append(self._visitor_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not rows:
+                    return
+                
+                with self.app.app_context():
+                    # values(rows) renders a single INSERT ... VALUES (...), (...) statement
+                    db.session.execute(insert(Visitor.__table__).values(rows))
+                    db.session.commit()
+    
+    def _maintenance_loop(self):
+        """Background loop that periodically prunes old records."""
+        while True:
+            try:
+                self.prune_old_records()
+            except Exception as e:
+                print(f"⚠️ Failed to prune old records: {e}")
+            time.sleep(PRUNE_INTERVAL)
+    
+    def prune_old_records(self):
+        """Delete visitors past the retention window and all but the newest Q&A logs."""
+        from datetime import timedelta
+        cutoff = datetime.utcnow() - timedelta(days=VISITOR_RETENTION_DAYS)
+        
         with self.app.app_context():
-            visitor = Visitor(
-                ip_address=ip_address,
-                user_agent=user_agent,
-                session_id=session_id,
-                visit_time=datetime.utcnow()
-            )
-            db.session.add(visitor)
+            db.session.execute(SQL_PRUNE_VISITORS, {"cutoff": cutoff})
+            db.session.execute(SQL_PRUNE_QA_LOGS, {"keep": QA_LOG_RETENTION_ROWS})
             db.session.commit()
     
     def get_visitor_count(self) -> int:
         """Get total visitor count."""
-        with self.app.app_context():
-            return Visitor.query.count()
+        return Visitor.query.count()
     
     def add_qa_log(self, question: str, answer: str, session_id: str, context_coverage: float):
         """Add Q&A log to database."""
-        with self.app.app_context():
-            qa_log = QALog(
-                question=question,
-                answer=answer,
-                session_id=session_id,
-                context_coverage=context_coverage,
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(qa_log)
-            db.session.commit()
+        db.session.execute(
+            SQL_INSERT_QA_LOG,
+            {
+                "q": question,
+                "a": answer,
+                "sid": session_id,
+                "cov": context_coverage,
+                "ts": datetime.utcnow()
+            }
+        )
+        db.session.commit()
     
     def get_qa_logs(self, limit: int = 50) -> List[Dict]:
         """Get recent Q&A logs."""
-        with self.app.app_context():
-            logs = QALog.query.order_by(QALog.timestamp.desc()).limit(limit).all()
-            return [
-                {
-                    'question': log.question,
-                    'answer': log.answer,
-                    'context_coverage': log.context_coverage,
-                    'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                }
-                for log in logs
-            ]
+        logs = QALog.query.order_by(QALog.timestamp.desc()).limit(limit).all()
+        return [
+            {
+                'question': log.question,
+                'answer': log.answer,
+                'context_coverage': log.context_coverage,
+                'timestamp': log.timestamp.isoformat(sep=' ', timespec='seconds')
+            }
+            for log in logs
+        ]
     
     def toggle_like(self, session_id: str) -> bool:
         """Toggle like status for session."""
-        with self.app.app_context():
-            existing_like = Like.query.filter_by(session_id=session_id).first()
-            
-            if existing_like:
-                # Toggle existing like
-                existing_like.liked = not existing_like.liked
-                new_status = existing_like.liked
-            else:
-                # Create new like
-                new_like = Like(
-                    session_id=session_id,
-                    liked=True,
-                    timestamp=datetime.utcnow()
-                )
-                db.session.add(new_like)
-                new_status = True
-            
-            db.session.commit()
-            return new_status
+        # Single round trip: insert a new like or flip the existing one
+        new_status = db.session.execute(
+            SQL_TOGGLE_LIKE,
+            {"sid": session_id, "liked": True, "ts": datetime.utcnow()}
+        ).scalar()
+        db.session.commit()
+        self._invalidate("like_count")
+        return bool(new_status)
     
     def get_like_count(self) -> int:
         """Get total number of likes."""
-        with self.app.app_context():
-            return Like.query.filter_by(liked=True).count()
+        return self._cached("like_count", self._query_like_count)
+    
+    def _query_like_count(self) -> int:
+        """Count likes directly from the database."""
+        return db.session.execute(SQL_COUNT_LIKES, {"liked": True}).scalar()
     
     def get_session_like_status(self, session_id: str) -> bool:
         """Get like status for specific session."""
-        with self.app.app_context():
-            like = Like.query.filter_by(session_id=session_id).first()
-            return like.liked if like else False
+        like = Like.query.filter_by(session_id=session_id).first()
+        return like.liked if like else False
     
     def cleanup_expired_sessions(self):
         """Clean up expired admin sessions."""
-        with self.app.app_context():
-            current_time = datetime.now().timestamp()
-            AdminSession.query.filter(AdminSession.expires_at < current_time).delete()
-            db.session.commit()
+        current_time = datetime.now().timestamp()
+        AdminSession.query.filter(AdminSession.expires_at < current_time).delete()
+        db.session.commit()
     
     def get_analytics(self) -> Dict:
         """Get comprehensive analytics data."""
-        with self.app.app_context():
-            # Visitor stats
-            total_visitors = Visitor.query.count()
-            
-            # Unique visitors (by session_id)
-            unique_visitors = db.session.query(Visitor.session_id).filter(Visitor.session_id.isnot(None)).distinct().count()
-            
-            # Q&A stats
-            total_qa = QALog.query.count()
-            
-            # Like stats
-            total_likes = Like.query.filter_by(liked=True).count()
-            
-            # Recent activity (24h)
-            from datetime import timedelta
-            yesterday = datetime.utcnow() - timedelta(hours=24)
-            visitors_24h = Visitor.query.filter(Visitor.visit_time > yesterday).count()
-            
-            return {
-                "total_visitors": total_visitors,
-                "unique_visitors": unique_visitors,
-                "total_qa": total_qa,
-                "total_likes": total_likes,
-                "visitors_24h": visitors_24h
-            }
+        return dict(self._cached("analytics", self._query_analytics))
+    
+    def _query_analytics(self) -> Dict:
+        """Compute analytics directly from the database."""
+        from datetime import timedelta
+        yesterday = datetime.utcnow() - timedelta(hours=24)
+        
+        # All counters in a single round trip
+        row = db.session.execute(
+            SQL_ANALYTICS,
+            {"liked": True, "since": yesterday}
+        ).mappings().one()
+        
+        return dict(row)
+    
+    def _get_admin_hash(self, username: str, refresh: bool = False) -> Optional[str]:
+        """Get the stored password hash for username, using the cache unless refresh is set."""
+        now = time.monotonic()
+        if not refresh:
+            with _admin_hash_lock:
+                entry = _admin_hash_cache.get(username)
+            if entry and entry[0] > now:
+                return entry[1]
+        
+        admin = AdminCredential.query.filter_by(username=username).first()
+        stored_hash = admin.password_hash if admin else None
+        with _admin_hash_lock:
+            if len(_admin_hash_cache) >= ADMIN_HASH_CACHE_MAX:
+                _admin_hash_cache.clear()
+            _admin_hash_cache[username] = (now + ADMIN_HASH_CACHE_TTL, stored_hash)
+        return stored_hash
     
     def verify_admin_password(self, username: str, password: str) -> bool:
         """Verify admin credentials."""
-        with self.app.app_context():
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            admin = AdminCredential.query.filter_by(username=username, password_hash=password_hash).first()
-            return admin is not None
+        stored_hash = self._get_admin_hash(username)
+        
+        # Unknown usernames are checked against a dummy scrypt hash and take the same
+        # retry path as a wrong password, so they can't be told apart by timing
+        matched = check_password(password, stored_hash or _dummy_hash())
+        if stored_hash is None or not matched:
+            # The cached entry may predate a password change, so retry once against the database
+            fresh_hash = self._get_admin_hash(username, refresh=True)
+            if fresh_hash is None or fresh_hash == stored_hash or not check_password(password, fresh_hash):
+                return False
+            stored_hash = fresh_hash
+        
+        # Upgrade legacy SHA-256 hashes on successful login
+        if _is_legacy_hash(stored_hash):
+            new_hash = hash_password(password)
+            AdminCredential.query.filter_by(username=username).update({"password_hash": new_hash})
+            db.session.commit()
+            with _admin_hash_lock:
+                _admin_hash_cache[username] = (time.monotonic() + ADMIN_HASH_CACHE_TTL, new_hash)
+        
+        return True
     
     def create_admin_session(self, username: str) -> str:
         """Create admin session token."""
-        with self.app.app_context():
-            session_token = secrets.token_urlsafe(32)
-            expires_at = datetime.now().timestamp() + (24 * 60 * 60)  # 24 hours
-            
-            admin_session = AdminSession(
-                username=username,
-                session_token=session_token,
-                expires_at=expires_at
-            )
-            db.session.add(admin_session)
-            db.session.commit()
-            
-            return session_token
+        session_token = secrets.token_urlsafe(32)
+        expires_at = datetime.now().timestamp() + (24 * 60 * 60)  # 24 hours
+        
+        admin_session = AdminSession(
+            username=username,
+            session_token=session_token,
+            expires_at=expires_at
+        )
+        db.session.add(admin_session)
+        db.session.commit()
+        
+        # Sessions only accumulate here, so prune expired ones at the same time
+        self.cleanup_expired_sessions()
+        
+        return session_token
     
     def verify_admin_session(self, session_token: str) -> bool:
         """Verify admin session token."""
-        with self.app.app_context():
-            current_time = datetime.now().timestamp()
-            session = AdminSession.query.filter_by(session_token=session_token).filter(AdminSession.expires_at > current_time).first()
-            return session is not None
+        current_time = datetime.now().timestamp()
+        return bool(db.session.execute(
+            SQL_ADMIN_SESSION_EXISTS,
+            {"token": session_token, "now": current_time}
+        ).scalar())
@@ -0,0 +1,12 @@
+# Gunicorn configuration
+import os
+
+# gevent workers let concurrent /chat requests overlap on I/O
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_connections = 100
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative with gevent in each worker."""
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
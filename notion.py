@@ -1,11 +1,18 @@
 import os
-import json
+import hashlib
+import shutil
+import orjson
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from notion_client import Client
 from dotenv import load_dotenv
 import openai
+from openai import AsyncOpenAI
 import numpy as np
 import faiss
-from rank_bm25 import BM25Okapi
+import bm25s
+from smart_ai import tokenize
 
 # -----------------------
 # Load environment variables
@@ -20,6 +27,18 @@ openai.api_key = OPENAI_API_KEY
 DB_PATH = "db/resume_sections.json"
 FAISS_INDEX_PATH = "db/resume_faiss.index"
 EMBEDDINGS_PATH = "db/resume_embeddings.npy"
+BM25S_PATH = "db/bm25s"
+BM25_PATH = "db/bm25.pkl"
+CORPUS_HASH_PATH = "db/corpus.hash"
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_CONCURRENCY = 5
+
+# Compressed IVF-PQ index for large corpora; PQ training needs ~39 points per centroid
+IVFPQ_FACTORY = "OPQ32,IVF16,PQ32x8"
+IVFPQ_MIN_VECTORS = 39 * 256
+
+# Tokenize in worker processes only when the corpus is large enough to pay for them
+PARALLEL_TOKENIZE_MIN_DOCS = 1000
 
 # Initialize Notion client
 notion = Client(auth=NOTION_TOKEN)
@@ -97,6 +116,113 @@ def fetch_hierarchical_sections():
     join_paragraphs(hierarchy)
     return hierarchy
 
+# -----------------------
+# OpenAI Embeddings
+# -----------------------
+async def _embed_batches(batches):
+    """Embed all batches concurrently, bounded by EMBEDDING_CONCURRENCY."""
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    sem = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    async def embed_batch(batch):
+        async with sem:
+            resp = await client.embeddings.create(
+                model="text-embedding-3-large",
+                input=batch
+            )
+            return [d.embedding for d in resp.data]
+
+    try:
+        return await asyncio.gather(*[embed_batch(b) for b in batches])
+    finally:
+        await client.close()
+
+def embed_corpus(corpus_texts):
+    """
+    Embed corpus texts with OpenAI, preserving input order.
+    Returns None if any request fails so callers can fall back to BM25.
+    """
+    batches = [
+        corpus_texts[i:i + EMBEDDING_BATCH_SIZE]
+        for i in range(0, len(corpus_texts), EMBEDDING_BATCH_SIZE)
+    ]
+    try:
+        results = asyncio.run(_embed_batches(batches))
+    except Exception as e:
+        print(f"WARNING: OpenAI embedding failed: {e}, will fallback to BM25.")
+        return None
+    return [emb for batch in results for emb in batch]
+
+def build_faiss_index(embeddings):
+    """
+    Build a FAISS index over the embeddings.
+    Small corpora use a flat index with float16 codes, larger ones a trained IVF-PQ index.
+    """
+    dim = embeddings.shape[1]
+    if len(embeddings) >= IVFPQ_MIN_VECTORS:
+        index = faiss.index_factory(dim, IVFPQ_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    else:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    index.add(embeddings)
+    return index
+
+def walk_sections(hierarchy):
+    """
+    Yield (title, content) for every leaf of the section hierarchy in document order.
+    Titles are the heading path joined with " > ".
+    """
+    stack = [((), iter(hierarchy.items()))]
+    while stack:
+        path, items = stack[-1]
+        for k, v in items:
+            if isinstance(v, dict):
+                stack.append((path + (k,), iter(v.items())))
+                break
+            yield " > ".join(path + (k,)), v
+        else:
+            stack.pop()
+
+def _write_atomically(path, write):
+    """
+    Call write(tmp_path) on a temp file next to path, then move it into place.
+    Readers in other workers only ever see the old or the complete new file.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"  # keep the extension, np.save appends .npy otherwise
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _write_bytes(data):
+    """Return a writer for _write_atomically that saves raw bytes."""
+    def write(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return write
+
+def _save_bm25_atomically(bm25):
+    """Save the bm25s index to a temp directory and swap it in place of BM25S_PATH."""
+    tmp_dir = BM25S_PATH + ".tmp"
+    old_dir = BM25S_PATH + ".old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    bm25.save(tmp_dir)
+    if os.path.isdir(BM25S_PATH):
+        os.replace(BM25S_PATH, old_dir)
+    os.replace(tmp_dir, BM25S_PATH)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def indexes_are_current(corpus_hash, num_chunks):
+    """Check whether the saved indexes were built from a corpus with this hash."""
+    if not os.path.exists(CORPUS_HASH_PATH):
+        return False
+    with open(CORPUS_HASH_PATH) as f:
+        if f.read().strip() != corpus_hash:
+            return False
+    if not (os.path.exists(FAISS_INDEX_PATH) and os.path.exists(BM25_PATH) and os.path.isdir(BM25S_PATH)):
+        return False
+    return faiss.read_index(FAISS_INDEX_PATH).ntotal == num_chunks
+
 # -----------------------
 # Save JSON + build FAISS + BM25
 # -----------------------
@@ -104,62 +230,70 @@ def save_json_and_build_index():
     hierarchy = fetch_hierarchical_sections()
     os.makedirs("db", exist_ok=True)
 
-    # Save JSON
-    with open(DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(hierarchy, f, indent=2, ensure_ascii=False)
-
     # Flatten JSON
-    flat_resume = []
-    def flatten_json(json_data, parent_keys=[]):
-        for k, v in json_data.items():
-            current_path = parent_keys + [k]
-            if isinstance(v, dict):
-                flatten_json(v, current_path)
-            else:
-                flat_resume.append({"title": " > ".join(current_path), "content": v})
-    flatten_json(hierarchy)
+    flat_resume = list(walk_sections(hierarchy))
+    titles = [title for title, _ in flat_resume]
+    corpus_texts = [content for _, content in flat_resume]
+
+    # Skip the rebuild when Notion returned the same content as last time
+    json_bytes = orjson.dumps(hierarchy, option=orjson.OPT_INDENT_2)
+    corpus_hash = hashlib.blake2b(json_bytes).hexdigest()
+    if indexes_are_current(corpus_hash, len(corpus_texts)):
+        print("SUCCESS: Resume unchanged, keeping existing indexes.")
+        return
 
-    corpus_texts = [item["content"] for item in flat_resume]
+    # Save JSON
+    _write_atomically(DB_PATH, _write_bytes(json_bytes))
 
     # -----------------------
     # OpenAI Embeddings
     # -----------------------
-    embeddings = []
-    for text in corpus_texts:
-        try:
-            resp = openai.embeddings.create(
-               model="text-embedding-3-large",
-               input=text
-)
-            embeddings.append(resp.data[0].embedding)
-        except Exception as e:
-            print(f"WARNING: OpenAI embedding failed: {e}, will fallback to BM25.")
-            embeddings = None
-            break
+    embeddings = embed_corpus(corpus_texts)
 
     # -----------------------
     # FAISS index if embeddings exist
     # -----------------------
     if embeddings:
         embeddings = np.array(embeddings, dtype="float32")
-        np.save(EMBEDDINGS_PATH, embeddings)
+        # Unit vectors make inner product equivalent to cosine similarity
+        faiss.normalize_L2(embeddings)
+        # Stored as float16 to halve disk size; upcast with .astype(np.float32) when reading
+        _write_atomically(EMBEDDINGS_PATH, lambda path: np.save(path, embeddings.astype(np.float16)))
 
-        dim = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dim)
-        index.add(embeddings)
-        faiss.write_index(index, FAISS_INDEX_PATH)
+        index = build_faiss_index(embeddings)
+        _write_atomically(FAISS_INDEX_PATH, lambda path: faiss.write_index(index, path))
         print("SUCCESS: FAISS index and OpenAI embeddings saved.")
+    elif os.path.exists(FAISS_INDEX_PATH):
+        # An index from the previous corpus would map ids onto the wrong chunks
+        os.remove(FAISS_INDEX_PATH)
 
     # -----------------------
     # BM25 fallback
     # -----------------------
-    tokenized_corpus = [text.split() for text in corpus_texts]
-    bm25 = BM25Okapi(tokenized_corpus)
-    with open("db/bm25.pkl", "wb") as f:
-        import pickle
-        pickle.dump({"bm25": bm25, "flat_resume": flat_resume}, f)
+    if len(corpus_texts) >= PARALLEL_TOKENIZE_MIN_DOCS:
+        # Spawn, not fork: the admin rebuild calls this from a threaded web worker
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as ex:
+            tokenized_corpus = list(ex.map(tokenize, corpus_texts, chunksize=64))
+    else:
+        tokenized_corpus = [tokenize(text) for text in corpus_texts]
+    bm25 = bm25s.BM25()
+    bm25.index(tokenized_corpus, show_progress=False)
+    _save_bm25_atomically(bm25)
+    # Written last: the app reloads when this file changes, so everything else must be in place
+    import pickle
+    _write_atomically(BM25_PATH, _write_bytes(pickle.dumps({
+        "titles": titles,
+        "contents": corpus_texts
+    })))
     print("SUCCESS: BM25 index saved as fallback.")
 
+    # Only record the hash once both indexes are built, so a failed embedding run is retried
+    if embeddings is not None and len(embeddings):
+        with open(CORPUS_HASH_PATH, "w") as f:
+            f.write(corpus_hash)
+    elif os.path.exists(CORPUS_HASH_PATH):
+        os.remove(CORPUS_HASH_PATH)
+
 if __name__ == "__main__":
     save_json_and_build_index()
 
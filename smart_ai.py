@@ -1,28 +1,144 @@
 import os
-import json
+import re
+import orjson
 import numpy as np
 import faiss
 import pickle
+import httpx
 from openai import OpenAI
-from rank_bm25 import BM25Okapi
+import bm25s
 from deep_translator import GoogleTranslator
+from langdetect import DetectorFactory, detect_langs
 import requests
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Sequence
 import time
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+# Word tokenizer shared by BM25 ingestion (notion.py) and querying
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into word tokens."""
+    return TOKEN_RE.findall(text.lower())
+
+@functools.lru_cache(maxsize=1024)
+def _tokenize_query(query: str) -> Tuple[str, ...]:
+    """Tokenize a query, caching repeated queries."""
+    return tuple(tokenize(query))
+
+# Canned replies for short greeting/contact messages, answered without retrieval or GPT
+GREETING_RESPONSE = "Hi! 😊 I'm <b>Sarmitha</b> — an AI/ML enthusiast from Tamil Nadu.<br>Wanna explore my projects, skills, or just chat about tech? 🚀"
+CONTACT_RESPONSE = "You can reach me at:<br>📧 sarmi8822@gmail.com<br>💼 linkedin.com/in/sarmithas<br>💻 github.com/sarmi2325<br>Let's connect! 😊"
+INTENT_MAX_WORDS = 6
+INTENT_PATTERNS = [
+    (re.compile(r"^\W*(hi|hello|hey|greetings)( there)?\W*$", re.IGNORECASE), GREETING_RESPONSE),
+    # Questions that also ask about projects/skills/work go to retrieval instead
+    (
+        re.compile(
+            r"^(?!.*\b(projects?|skills?|work(ed|ing)?|experience)\b)"
+            r".*\b(contact|reach (you|out)|e-?mail|linkedin)\b",
+            re.IGNORECASE,
+        ),
+        CONTACT_RESPONSE,
+    ),
+]
+
+# Deterministic offline language detection
+DetectorFactory.seed = 0
+
+# Minimum langdetect confidence before treating input as non-English
+LANG_DETECT_MIN_PROB = 0.9
+
+# Clusters searched per query when the index is IVF-based
+FAISS_NPROBE = 4
+
+# Number of distinct query embeddings kept in memory
+EMBEDDING_CACHE_SIZE = 512
+
+# Concurrent FAISS searches already queued together are run as one batch; small
+# indexes are searched directly since batching can't beat the thread hop there
+SEARCH_MAX_BATCH = 16
+SEARCH_BATCH_MIN_VECTORS = 10000
+
+class _BatchedSearcher:
+    """Coalesce concurrent single-query FAISS searches into one batched search."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="faiss-search", daemon=True)
+        self._thread.start()
+
+    def search(self, index, query_embedding: np.ndarray, k: int):
+        """Search one (1, dim) query on index, returning (scores, indices) like index.search."""
+        future = Future()
+        self._queue.put((index, query_embedding, k, future))
+        return future.result()
+
+    def _run(self):
+        """Background loop that drains queued queries and searches them together."""
+        while True:
+            batch = [self._queue.get()]
+            # Take whatever else is already waiting, without delaying the first query
+            while len(batch) < SEARCH_MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Queries may target different indexes if one was reloaded in between
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[0]), []).append(item)
+            for group in groups.values():
+                self._search_group(group)
+
+    def _search_group(self, group):
+        """Run one batched search for queries on the same index and resolve their futures."""
+        try:
+            index = group[0][0]
+            k = max(item[2] for item in group)
+            queries = np.vstack([item[1] for item in group])
+            scores, indices = index.search(queries, k)
+            # Rows are sorted, so each request's top-k is a prefix of the batch top-k
+            for row, (_, _, item_k, future) in enumerate(group):
+                future.set_result((scores[row:row + 1, :item_k], indices[row:row + 1, :item_k]))
+        except Exception as e:
+            for _, _, _, future in group:
+                future.set_exception(e)
 
 class SmartAIPortfolio:
     def __init__(self):
         """Initialize the Smart AI Portfolio System with GPT-4o and BM25 fallback."""
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # One keep-alive HTTP/2 client shared by embedding and chat calls
+        self.openai_client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.Client(
+                http2=True,
+                timeout=30.0,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=32)
+            )
+        )
         self.db_path = "db/resume_sections.json"
         self.faiss_path = "db/resume_faiss.index"
         self.embeddings_path = "db/resume_embeddings.npy"
         self.bm25_path = "db/bm25.pkl"
+        self.bm25s_path = "db/bm25s"
         
         # Load or initialize components
-        self.resume_data = self._load_resume_data()
-        self.faiss_index = self._load_faiss_index()
-        self.bm25_data = self._load_bm25_data()
+        self._reload_lock = threading.Lock()
+        self._loaded_mtime = None
+        self.resume_data = {}
+        self._indexes = (None, {})
+        self._reload()
+        
+        # Cache query embeddings so repeated questions skip the OpenAI call
+        self._embed_cached = functools.lru_cache(maxsize=EMBEDDING_CACHE_SIZE)(self._fetch_embedding)
+        
+        # Batches FAISS searches from concurrent requests
+        self._searcher = _BatchedSearcher()
         
         # System prompt (optimized and reduced)
         self.system_prompt = """You are Sarmitha, a 22-year-old AI/ML Engineer from Coimbatore, Tamil Nadu.
@@ -49,11 +165,57 @@ GUARDRAILS:
 - Refuse to answer unrelated questions politely
 - Stay in character as Sarmitha"""
 
+    @property
+    def faiss_index(self):
+        """FAISS index from the currently loaded build."""
+        return self._indexes[0]
+
+    @property
+    def bm25_data(self) -> Dict:
+        """BM25 model and chunk lists from the currently loaded build."""
+        return self._indexes[1]
+
+    def _index_mtime(self):
+        """
+        Get the modification time of the BM25 pickle.
+        notion.py replaces it last, so a change means a whole rebuild is in place.
+        """
+        return os.path.getmtime(self.bm25_path) if os.path.exists(self.bm25_path) else None
+
+    def _reload(self, only_if_changed: bool = False):
+        """Load all indexes and swap them in together."""
+        with self._reload_lock:
+            mtime = self._index_mtime()
+            # Another request may have reloaded while this one waited for the lock
+            if only_if_changed and mtime == self._loaded_mtime:
+                return
+            try:
+                resume_data = self._load_resume_data()
+            except Exception:
+                resume_data = {}
+            faiss_index = self._load_faiss_index()
+            bm25_data = self._load_bm25_data()
+            
+            # FAISS ids index into contents, so never pair an index with chunks from another build
+            contents = bm25_data.get('contents', [])
+            if faiss_index is not None and faiss_index.ntotal != len(contents):
+                print("⚠️ FAISS index does not match BM25 chunks, using BM25 only")
+                faiss_index = None
+            
+            self.resume_data = resume_data
+            self._indexes = (faiss_index, bm25_data)
+            self._loaded_mtime = mtime
+
+    def _reload_if_changed(self):
+        """Reload indexes if another process rebuilt them since they were loaded."""
+        if self._index_mtime() != self._loaded_mtime:
+            self._reload(only_if_changed=True)
+
     def _load_resume_data(self) -> Dict:
         """Load resume data from JSON file."""
         try:
-            with open(self.db_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.db_path, 'rb') as f:
+                return orjson.loads(f.read())
         except FileNotFoundError:
             pass
             return {}
@@ -62,7 +224,18 @@ GUARDRAILS:
         """Load FAISS index for semantic search."""
         try:
             if os.path.exists(self.faiss_path):
-                return faiss.read_index(self.faiss_path)
+                try:
+                    # IO_FLAG_MMAP only maps IVF inverted lists; IO_FLAG_MMAP_IFC (faiss >= 1.12)
+                    # also maps the codes of flat/SQ indexes, which is what small corpora use
+                    mmap_flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+                    index = faiss.read_index(self.faiss_path, mmap_flags | faiss.IO_FLAG_READ_ONLY)
+                except Exception:
+                    index = faiss.read_index(self.faiss_path)
+                # IVF indexes only scan nprobe clusters per query
+                ivf = faiss.try_extract_index_ivf(index)
+                if ivf is not None:
+                    ivf.nprobe = FAISS_NPROBE
+                return index
         except Exception as e:
             pass
         return None
@@ -72,16 +245,27 @@ GUARDRAILS:
         try:
             if os.path.exists(self.bm25_path):
                 with open(self.bm25_path, 'rb') as f:
-                    return pickle.load(f)
+                    data = pickle.load(f)
+                # Older pickles store chunks as a list of {"title", "content"} dicts
+                if 'flat_resume' in data:
+                    flat_resume = data.pop('flat_resume')
+                    data['titles'] = [item['title'] for item in flat_resume]
+                    data['contents'] = [item['content'] for item in flat_resume]
+                # Prefer the bm25s index; older pickles carry a rank_bm25 model instead
+                if os.path.isdir(self.bm25s_path):
+                    data['bm25'] = bm25s.BM25.load(self.bm25s_path)
+                return data
         except Exception as e:
             pass
         return {}
 
 
     def _detect_language(self, text: str) -> str:
-        """Detect input language."""
+        """Detect input language offline."""
         try:
-            return GoogleTranslator(source='auto', target='en').detect(text)[0]
+            best = detect_langs(text)[0]
+            # Short inputs are often misdetected, so default to English unless confident
+            return best.lang if best.prob >= LANG_DETECT_MIN_PROB else 'en'
         except:
             return 'en'
 
@@ -92,21 +276,29 @@ GUARDRAILS:
         except:
             return text
 
+    def _fetch_embedding(self, text: str) -> bytes:
+        """Fetch OpenAI embedding for text as raw float32 bytes."""
+        response = self.openai_client.embeddings.create(
+            model="text-embedding-3-large",  # Match the model used in notion.py
+            input=text
+        )
+        return np.array(response.data[0].embedding, dtype="float32").tobytes()
+
     def _get_openai_embedding(self, text: str) -> np.ndarray:
         """Get OpenAI embedding for text."""
+        key = " ".join(text.lower().split())
         try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-large",  # Match the model used in notion.py
-                input=text
-            )
-            return np.array(response.data[0].embedding, dtype="float32")
+            return np.frombuffer(self._embed_cached(key), dtype="float32").copy()
         except Exception as e:
             pass
             return None
 
     def _semantic_retrieve(self, query: str, top_k: int = 5) -> List[str]:
         """Retrieve relevant content using semantic search."""
-        if not self.faiss_index or not self.bm25_data:
+        self._reload_if_changed()
+        # Take both from one snapshot so they always come from the same build
+        faiss_index, bm25_data = self._indexes
+        if not faiss_index or not bm25_data:
             return self._bm25_retrieve(query, top_k)
 
         # Get query embedding
@@ -117,57 +309,60 @@ GUARDRAILS:
         try:
             # Search FAISS index
             query_embedding = np.expand_dims(query_embedding, axis=0)
-            scores, indices = self.faiss_index.search(query_embedding, top_k)
+            faiss.normalize_L2(query_embedding)
+            if faiss_index.ntotal >= SEARCH_BATCH_MIN_VECTORS:
+                scores, indices = self._searcher.search(faiss_index, query_embedding, top_k)
+            else:
+                scores, indices = faiss_index.search(query_embedding, top_k)
             
             # Get corresponding text chunks with scores
-            flat_resume = self.bm25_data.get('flat_resume', [])
+            contents = bm25_data.get('contents', [])
             
-            results_with_scores = []
-            for i, idx in enumerate(indices[0]):
-                if 0 <= idx < len(flat_resume):
-                    results_with_scores.append({
-                        'content': flat_resume[idx]['content'],
-                        'title': flat_resume[idx]['title'],
-                        'score': scores[0][i]
-                    })
+            results_with_scores = [
+                (scores[0][i], contents[idx])
+                for i, idx in enumerate(indices[0])
+                if 0 <= idx < len(contents)
+            ]
             
-            # Sort by relevance score (lower is better for L2 distance)
-            results_with_scores.sort(key=lambda x: x['score'])
+            # Sort by relevance score (higher is better for inner product, lower for L2 distance)
+            higher_is_better = faiss_index.metric_type == faiss.METRIC_INNER_PRODUCT
+            results_with_scores.sort(key=lambda x: x[0], reverse=higher_is_better)
             
-            return [result['content'] for result in results_with_scores]
+            return [content for _, content in results_with_scores]
         except Exception as e:
             pass
             return self._bm25_retrieve(query, top_k)
 
     def _bm25_retrieve(self, query: str, top_k: int = 5) -> List[str]:
         """Retrieve relevant content using BM25 keyword search."""
-        if not self.bm25_data:
+        bm25_data = self.bm25_data
+        if not bm25_data:
             return []
 
         try:
-            bm25 = self.bm25_data.get('bm25')
-            flat_resume = self.bm25_data.get('flat_resume', [])
+            bm25 = bm25_data.get('bm25')
+            contents = bm25_data.get('contents', [])
             
-            if not bm25 or not flat_resume:
+            if bm25 is None or not contents:
                 return []
 
-            # Tokenize query and get scores
-            tokenized_query = query.split()
-            scores = bm25.get_scores(tokenized_query)
-            
-            # Get top-k results with scores
-            top_indices = np.argsort(scores)[-top_k:][::-1]
-            results_with_scores = []
-            for idx in top_indices:
-                if 0 <= idx < len(flat_resume):
-                    results_with_scores.append({
-                        'content': flat_resume[idx]['content'],
-                        'title': flat_resume[idx]['title'],
-                        'score': scores[idx]
-                    })
-            
-            
-            return [result['content'] for result in results_with_scores]
+            if isinstance(bm25, bm25s.BM25):
+                # Vectorized scoring and top-k selection
+                k = min(top_k, len(contents))
+                query_tokens = [list(_tokenize_query(query))]
+                top_indices, _ = bm25.retrieve(query_tokens, k=k, show_progress=False)
+                top_indices = top_indices[0]
+            else:
+                # Tokenize query the same way the legacy index was built
+                tokenized_query = query.split()
+                scores = np.asarray(bm25.get_scores(tokenized_query), dtype=np.float32)
+                
+                # Get top-k results with scores, partitioning instead of a full sort
+                k = min(top_k, len(scores))
+                candidates = np.argpartition(scores, -k)[-k:]
+                top_indices = candidates[np.argsort(scores[candidates])[::-1]]
+
+            return [contents[idx] for idx in top_indices if 0 <= idx < len(contents)]
         except Exception as e:
             pass
             return []
@@ -229,7 +424,7 @@ GUARDRAILS:
         user_lower = user_message.lower()
         
         if any(word in user_lower for word in ["hello", "hi", "hey", "greetings"]):
-            return "Hi! 😊 I'm <b>Sarmitha</b> — an AI/ML enthusiast from Tamil Nadu.<br>Wanna explore my projects, skills, or just chat about tech? 🚀"
+            return GREETING_RESPONSE
         
         elif any(word in user_lower for word in ["project", "work", "built", "developed"]):
             if context_text:
@@ -244,7 +439,7 @@ GUARDRAILS:
                 return "I work with Python, TensorFlow, Keras, Flask, and various ML libraries.<br>What technology would you like to know about? 🚀"
         
         elif any(word in user_lower for word in ["contact", "email", "linkedin", "github"]):
-            return "You can reach me at:<br>📧 sarmi8822@gmail.com<br>💼 linkedin.com/in/sarmithas<br>💻 github.com/sarmi2325<br>Let's connect! 😊"
+            return CONTACT_RESPONSE
         
         elif any(word in user_lower for word in ["about", "who", "background", "education"]):
             if context_text:
@@ -269,28 +464,40 @@ GUARDRAILS:
         coverage = min(total_content_length / 500, 1.0)  # Assume 500 chars = 100% coverage (lower threshold)
         return round(coverage, 2)
 
-    def process_query(self, user_input: str, chat_history: List[Dict] = None) -> Tuple[str, float]:
+    def _match_intent(self, user_input: str):
+        """Return a canned response for short greeting/contact messages, else None."""
+        if len(user_input.split()) > INTENT_MAX_WORDS:
+            return None
+        for pattern, response in INTENT_PATTERNS:
+            if pattern.search(user_input):
+                return response
+        return None
+
+    def process_query(self, user_input: str, chat_history: Sequence[Dict] = ()) -> Tuple[str, float]:
         """Process user query and return response with context coverage."""
         if chat_history is None:
-            chat_history = []
+            chat_history = ()
+        
+        context_coverage = self._query_coverage(chat_history)
+        
+        # Short greetings and contact requests skip retrieval and GPT entirely
+        canned_response = self._match_intent(user_input)
+        if canned_response:
+            return canned_response, context_coverage
         
         # Detect language and translate to English
         user_lang = self._detect_language(user_input)
-        user_msg_en = self._translate_to_english(user_input)
+        if user_lang == "en":
+            user_msg_en = user_input
+        else:
+            user_msg_en = self._translate_to_english(user_input)
         
         # Retrieve relevant context (reduced from 5 to 3 for lower context)
         relevant_content = self._semantic_retrieve(user_msg_en, top_k=3)
         context_text = "\n".join(relevant_content) if relevant_content else ""
         
-        
-        # Calculate context coverage based on query count (5 queries = 100%)
-        # Count user messages only (each query is a user message)
-        user_messages = [msg for msg in chat_history if msg.get("role") == "user"]
-        query_count = len(user_messages) + 1  # +1 for current query
-        context_coverage = min(query_count / 5.0, 1.0)
-        
         # Prepare messages for AI
-        messages = chat_history + [{"role": "user", "content": user_msg_en}]
+        messages = [*chat_history, {"role": "user", "content": user_msg_en}]
         
         # Get response from GPT-4o with fallback
         response = self._call_gpt4o(messages, context_text)
@@ -308,36 +515,29 @@ GUARDRAILS:
         try:
             print("🔄 Starting embedding update process...")
             
-            # Re-run the notion.py script to update embeddings
-            import subprocess
+            # Rebuild embeddings in-process, reusing the already loaded modules
+            from notion import save_json_and_build_index
             print("📥 Fetching latest data from Notion...")
-            # Use the same Python interpreter as the current process
-            import sys
-            python_path = sys.executable
-            result = subprocess.run([python_path, "notion.py"], capture_output=True, text=True)
-            if result.returncode == 0:
+            try:
+                save_json_and_build_index()
                 print("✅ Notion.py executed successfully")
-                print(f"Output: {result.stdout}")
-            else:
-                print(f"❌ Notion.py failed with return code: {result.returncode}")
-                print(f"Error output: {result.stderr}")
-                raise Exception(f"notion.py failed: {result.stderr}")
+            except Exception as e:
+                print(f"❌ Notion.py failed: {e}")
+                raise Exception(f"notion.py failed: {e}")
             
             # Reload components
             print("🔄 Reloading components...")
-            self.resume_data = self._load_resume_data()
+            self._reload()
             print(f"✅ Resume data reloaded: {len(self.resume_data)} sections")
             
-            self.faiss_index = self._load_faiss_index()
             if self.faiss_index:
                 print(f"✅ FAISS index reloaded: {self.faiss_index.ntotal} vectors, {self.faiss_index.d} dimensions")
             else:
                 print("⚠️ FAISS index failed to reload")
             
-            self.bm25_data = self._load_bm25_data()
             if self.bm25_data:
-                flat_resume = self.bm25_data.get('flat_resume', [])
-                print(f"✅ BM25 data reloaded: {len(flat_resume)} chunks")
+                contents = self.bm25_data.get('contents', [])
+                print(f"✅ BM25 data reloaded: {len(contents)} chunks")
             else:
                 print("⚠️ BM25 data failed to reload")
             
@@ -347,11 +547,27 @@ GUARDRAILS:
             import traceback
             traceback.print_exc()
 
+    def _query_coverage(self, chat_history) -> float:
+        """Calculate context coverage based on query count (5 queries = 100%)."""
+        # Count user messages only (each query is a user message)
+        query_count = sum(1 for msg in chat_history if msg.get("role") == "user") + 1  # +1 for current query
+        return min(query_count / 5.0, 1.0)
+
     def get_context_coverage(self, query: str, chat_history: List[Dict] = None) -> float:
         """Get context coverage for a query without processing."""
         if chat_history is None:
             chat_history = []
-        # Count user messages only (each query is a user message)
-        user_messages = [msg for msg in chat_history if msg.get("role") == "user"]
-        query_count = len(user_messages) + 1  # +1 for current query
-        return min(query_count / 5.0, 1.0)  # 5 queries = 100% coverage
+        return self._query_coverage(chat_history)
+
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_portfolio() -> SmartAIPortfolio:
+    """Get the shared SmartAIPortfolio instance, creating it on first use."""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = SmartAIPortfolio()
+    return _instance